@@ -1,12 +1,154 @@
 import os
+import heapq
 import pickle
+import cv2
+import numpy as np
 import face_recognition
 import mysql.connector
 from tqdm import tqdm
+from face_matching import MATCH_THRESHOLD
 
 # Config
 OUTPUT_PATH = "/home/pi/EduFace/encodings.pkl"
 MIN_IMAGES_PER_STUDENT = 1
+IMAGE_EXTS = ('.png', '.jpg', '.jpeg')
+VIDEO_EXTS = ('.mp4', '.avi', '.mov', '.mkv', '.h264')
+
+# Gallery size: keep at most this many well-spread encodings per student
+MAX_ENCODINGS_PER_STUDENT = 8
+DUPLICATE_DISTANCE = 0.12   # closer than this to a kept encoding = near-identical
+# Farther than the live match threshold from a clip's medoid = bystander / bad frame
+OUTLIER_DISTANCE = MATCH_THRESHOLD
+
+# Video enrollment (DATASET_PATH may be a clip or a folder holding one)
+VIDEO_FRAME_STEP = 3        # decode every frame, look at every Nth
+VIDEO_DETECT_SCALE = 0.5    # detect on a downscaled frame
+MIN_SHARPNESS = 60.0        # variance of Laplacian on the face crop
+MAX_VIDEO_CANDIDATES = 40   # stop reading the clip once this many distinct encodings are found
+TRACK_MAX_JUMP = 1.0        # max centre movement between sampled frames, in face widths
+
+# =========================
+# VIDEO ENROLLMENT HELPERS
+# =========================
+def video_frames(path, step=VIDEO_FRAME_STEP):
+    """Yield every step-th frame of a clip as RGB without loading the whole clip"""
+    cap = cv2.VideoCapture(path)
+    try:
+        index = 0
+        while True:
+            if not cap.grab():
+                break
+            if index % step == 0:
+                ok, frame = cap.retrieve()
+                if ok:
+                    yield cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            index += 1
+    finally:
+        cap.release()
+
+def track_face(rgb, last_box):
+    """Locate the enrolling student's face, following it from the previous frame.
+
+    Returns None when no face is found or the nearest one jumped too far to
+    be the same face; the caller then drops last_box and re-acquires.
+    """
+    small = cv2.resize(rgb, (0, 0), fx=VIDEO_DETECT_SCALE, fy=VIDEO_DETECT_SCALE)
+    boxes = [tuple(int(v / VIDEO_DETECT_SCALE) for v in b) for b in face_recognition.face_locations(small)]
+    if not boxes:
+        return None
+    if last_box is None:
+        # Start on the largest face
+        return max(boxes, key=lambda b: (b[2] - b[0]) * (b[1] - b[3]))
+
+    def centre(b):
+        return ((b[1] + b[3]) / 2, (b[0] + b[2]) / 2)
+
+    lx, ly = centre(last_box)
+    box = min(boxes, key=lambda b: (centre(b)[0] - lx) ** 2 + (centre(b)[1] - ly) ** 2)
+    cx, cy = centre(box)
+    if ((cx - lx) ** 2 + (cy - ly) ** 2) ** 0.5 > TRACK_MAX_JUMP * (last_box[1] - last_box[3]):
+        return None
+    return box
+
+def sharpness(rgb, box):
+    top, right, bottom, left = box
+    crop = rgb[max(top, 0):bottom, max(left, 0):right]
+    if crop.size == 0:
+        return 0.0
+    return cv2.Laplacian(cv2.cvtColor(crop, cv2.COLOR_RGB2GRAY), cv2.CV_64F).var()
+
+def is_duplicate(enc, kept):
+    return bool(kept) and np.min(np.linalg.norm(np.asarray(kept) - enc, axis=1)) < DUPLICATE_DISTANCE
+
+def keep_encoding(rgb, box, encs):
+    found = face_recognition.face_encodings(rgb, [box])
+    if found and not is_duplicate(found[0], encs):
+        encs.append(found[0])
+
+def encode_video(path):
+    """Encode sharp, non-duplicate frames of the tracked face in a clip.
+
+    Identity is checked once at the end against the medoid of all candidates,
+    the same way for sharp frames and the blurry fallback, so no single early
+    frame (possibly a bystander's) decides who the clip belongs to.
+    """
+    encs = []
+    blurry = []  # min-heap of the sharpest rejected frames, in case none pass MIN_SHARPNESS
+    last_box = None
+    for n, rgb in enumerate(video_frames(path)):
+        box = track_face(rgb, last_box)
+        last_box = box
+        if box is None:
+            continue
+
+        score = sharpness(rgb, box)
+        if score < MIN_SHARPNESS:
+            if not encs:
+                entry = (score, n, rgb, box)
+                if len(blurry) < MAX_ENCODINGS_PER_STUDENT:
+                    heapq.heappush(blurry, entry)
+                else:
+                    heapq.heappushpop(blurry, entry)
+            continue
+
+        keep_encoding(rgb, box, encs)
+        if len(encs) >= MAX_VIDEO_CANDIDATES:
+            break
+
+    if not encs and blurry:
+        # Soft or low-resolution clip: fall back to its sharpest frames
+        print(f"[WARN] No frame of {path} reached sharpness {MIN_SHARPNESS}; using the sharpest {len(blurry)}")
+        for _, _, rgb, box in sorted(blurry, reverse=True):
+            keep_encoding(rgb, box, encs)
+    return reject_outliers(encs)
+
+def medoid_distances(encs):
+    """Distance of every encoding to the medoid (the one closest to all others)"""
+    arr = np.asarray(encs)
+    pairwise = np.linalg.norm(arr[:, np.newaxis, :] - arr[np.newaxis, :, :], axis=2)
+    return pairwise[int(np.argmin(pairwise.sum(axis=1)))]
+
+def reject_outliers(encs):
+    """Drop video encodings far from the medoid; needs at least 3 to tell who is the outlier"""
+    if len(encs) < 3:
+        return list(encs)
+    dist = medoid_distances(encs)
+    return [enc for enc, d in zip(encs, dist) if d <= OUTLIER_DISTANCE]
+
+def select_diverse(encs, limit=MAX_ENCODINGS_PER_STUDENT):
+    """Farthest-point selection: start at the medoid and keep adding the one
+    farthest from everything already picked"""
+    if len(encs) <= limit:
+        return list(encs)
+
+    arr = np.asarray(encs)
+    picked = [int(np.argmin(medoid_distances(encs)))]
+    min_dist = np.linalg.norm(arr - arr[picked[0]], axis=1)
+    while len(picked) < limit:
+        nxt = int(np.argmax(min_dist))
+        picked.append(nxt)
+        min_dist = np.minimum(min_dist, np.linalg.norm(arr - arr[nxt], axis=1))
+    return [encs[i] for i in picked]
 
 # Connect to DB
 db = mysql.connector.connect(
@@ -29,27 +171,39 @@ for s in tqdm(students, desc="Students"):
         print(f"[WARN] Student {sid} ({s['name']}) has missing dataset_folder: {folder}")
         continue
 
-    files = [os.path.join(folder, f) for f in os.listdir(folder) if f.lower().endswith(('.png', '.jpg', '.jpeg'))]
+    if os.path.isfile(folder):
+        files = [folder]
+    else:
+        files = [os.path.join(folder, f) for f in os.listdir(folder) if f.lower().endswith(IMAGE_EXTS + VIDEO_EXTS)]
     if not files:
-        print(f"[WARN] No images found for {sid} in {folder}")
+        print(f"[WARN] No images or videos found for {sid} in {folder}")
         continue
 
-    count = 0
-    for img_path in files:
+    image_encs = []
+    video_encs = []
+    for path in files:
         try:
-            img = face_recognition.load_image_file(img_path)
+            if path.lower().endswith(VIDEO_EXTS):
+                video_encs.extend(encode_video(path))
+                continue
+
+            img = face_recognition.load_image_file(path)
             encs = face_recognition.face_encodings(img)
             if not encs:
                 # try model='hog' fallback
                 encs = face_recognition.face_encodings(img, model='hog')
-            if encs:
+            if encs and not is_duplicate(encs[0], image_encs):
                 # store first face encoding for this image
-                known_encodings.append(encs[0])
-                known_ids.append(sid)
-                count += 1
+                image_encs.append(encs[0])
         except Exception as e:
-            print(f"[ERROR] processing {img_path}: {e}")
+            print(f"[ERROR] processing {path}: {e}")
+
+    # Still images are curated by hand; clips already had outliers removed in encode_video
+    selected = select_diverse(image_encs + video_encs)
+    known_encodings.extend(selected)
+    known_ids.extend([sid] * len(selected))
 
+    count = len(selected)
     if count < MIN_IMAGES_PER_STUDENT:
         print(f"[WARN] Only {count} valid encodings for student {sid} ({s['name']})")
 
@@ -9,6 +9,15 @@ import pickle
 import os
 import numpy as np
 import threading
+import base64
+import requests
+import json
+import itertools
+import queue
+import logging
+import atexit
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from face_matching import match_encodings
 
 # =========================
 # CAMERA CONFIG
@@ -17,6 +26,50 @@ CAMERA_DEVICE = 0
 FRAME_WIDTH = 640
 FRAME_HEIGHT = 480
 
+# =========================
+# RECOGNITION CONFIG
+# =========================
+STABLE_FRAMES = 5
+
+# Face tracks follow boxes between frames, independent of identity
+TRACK_MIN_IOU = 0.3        # overlap needed to continue a track
+TRACK_MAX_MISSES = 5       # frames a track survives without a matching box
+
+# Rush-hour multi-face mode: switches on when at least MULTI_FACE_MIN_FACES
+# faces are seen for MULTI_FACE_ENTER_FRAMES consecutive frames, and back off
+# after MULTI_FACE_EXIT_FRAMES consecutive frames with fewer faces.
+MULTI_FACE_MIN_FACES = 2
+MULTI_FACE_ENTER_FRAMES = 3
+MULTI_FACE_EXIT_FRAMES = 30
+
+# =========================
+# REMOTE WORKER CONFIG
+# =========================
+# Optional offload of encoding + matching to recognition_worker.py on the LAN.
+# Leave REMOTE_WORKER_URL unset to recognize everything on the Pi.
+REMOTE_WORKER_URL = os.environ.get('REMOTE_WORKER_URL')
+CAMERA_NAME = os.environ.get('CAMERA_NAME', 'gate')
+REMOTE_TIMEOUT = 1.0
+REMOTE_RETRY_AFTER = 30    # seconds on-device before trying the worker again
+CROP_MARGIN = 0.25         # extra border around each face crop
+CROP_JPEG_QUALITY = 85
+# REMOTE_PREDETECT=0 skips detection on the Pi and sends the whole frame instead.
+# REMOTE_FRAME_SCALE < 1 shrinks that frame to save bandwidth, at a cost in
+# accuracy: faces under ~80 px / scale are missed by HOG, and the rest get
+# coarser encodings matched against a full-resolution gallery.
+REMOTE_PREDETECT = os.environ.get('REMOTE_PREDETECT', '1') != '0'
+REMOTE_FRAME_SCALE = float(os.environ.get('REMOTE_FRAME_SCALE', '1.0'))
+
+# =========================
+# EVENT LOG CONFIG
+# =========================
+# One compact JSON line per recognized face; replay with replay_events.py
+EVENT_LOG_PATH = os.environ.get('EVENT_LOG_PATH', '/home/pi/EduFace/logs/recognition_events.log')
+# ~110 MB in total (~600k events), so a full day, including unknown faces
+# logged every frame, fits before the morning's "marked" lines rotate out
+EVENT_LOG_MAX_BYTES = 10 * 1024 * 1024
+EVENT_LOG_BACKUPS = 10
+
 # =========================
 # SERVO CONFIG (using pigpio)
 # =========================
@@ -50,12 +103,49 @@ db = mysql.connector.connect(
 )
 cursor = db.cursor(dictionary=True)
 
+# =========================
+# RECOGNITION EVENT LOG
+# =========================
+# Events go through a queue so file writes and rotation happen on a
+# background thread, never in the camera loop.
+if os.path.dirname(EVENT_LOG_PATH):
+    os.makedirs(os.path.dirname(EVENT_LOG_PATH), exist_ok=True)
+event_file_handler = RotatingFileHandler(EVENT_LOG_PATH, maxBytes=EVENT_LOG_MAX_BYTES,
+                                         backupCount=EVENT_LOG_BACKUPS)
+event_file_handler.setFormatter(logging.Formatter("%(message)s"))
+event_queue = queue.Queue(-1)
+event_listener = QueueListener(event_queue, event_file_handler)
+event_listener.start()
+# Flush queued events on any exit (q, Ctrl-C or a crash), not just a clean quit
+atexit.register(event_listener.stop)
+
+event_log = logging.getLogger("eduface.events")
+event_log.setLevel(logging.INFO)
+event_log.propagate = False
+event_log.addHandler(QueueHandler(event_queue))
+
+def log_event(frame_ts, track, student_id, candidates, decision, status=None):
+    event = {
+        "ts": round(frame_ts, 3),
+        "cam": CAMERA_NAME,
+        "track": track,
+        "sid": student_id,
+        "cand": [c[0] for c in candidates],
+        "dist": [round(float(c[1]), 4) for c in candidates],
+        "dec": decision,
+        "lat": round((t.time() - frame_ts) * 1000, 1),
+    }
+    if status:
+        event["status"] = status
+    event_log.info(json.dumps(event, separators=(",", ":")))
+
 # =========================
 # LOAD ENCODINGS
 # =========================
 print("[INFO] Loading face encodings...")
 with open("/home/pi/EduFace/encodings.pkl", "rb") as f:
     known_encodings, known_ids = pickle.load(f)
+known_matrix = np.asarray(known_encodings)
 print(f"[INFO] Loaded {len(known_encodings)} encodings")
 
 # =========================
@@ -77,6 +167,24 @@ last_unknown = False
 marked_today = set()
 recognition_stable_count = {}
 
+# Live face tracks: track id -> {"box": last box, "misses": frames unseen}
+tracks = {}
+# Tracks that already logged a "known" re-sighting of a marked student
+known_logged_tracks = set()
+track_counter = itertools.count(1)
+
+# =========================
+# MULTI-FACE MODE STATE
+# =========================
+multi_face_mode = False
+crowded_frames = 0
+quiet_frames = 0
+
+# Time until which the remote worker is skipped after a failure
+remote_down_until = 0
+# Keep-alive connection to the worker, reused for every frame
+remote_session = requests.Session()
+
 # =========================
 # CAMERA INITIALIZATION
 # =========================
@@ -96,17 +204,284 @@ def mark_attendance(student_id, status):
     today = now.date()
     cur_time = now.time()
 
-    cursor.execute("SELECT id FROM attendance WHERE student_id=%s AND date=%s", (student_id, today))
-    if cursor.fetchone():
-        return  # already marked
+    try:
+        # Re-open the connection if MySQL dropped it since the last mark
+        db.ping(reconnect=True, attempts=2, delay=1)
+        cur = db.cursor()
+
+        cur.execute("SELECT id FROM attendance WHERE student_id=%s AND date=%s", (student_id, today))
+        if cur.fetchone():
+            return  # already marked
 
-    cursor.execute(
-        "INSERT INTO attendance (student_id, date, time, status) VALUES (%s, %s, %s, %s)",
-        (student_id, today, cur_time, status)
-    )
-    db.commit()
+        cur.execute(
+            "INSERT INTO attendance (student_id, date, time, status) VALUES (%s, %s, %s, %s)",
+            (student_id, today, cur_time, status)
+        )
+        db.commit()
+    except mysql.connector.Error as e:
+        # The "marked" event is already in the event log; backfill with replay_events.py
+        print(f"[ERROR] Could not save attendance for {student_id}: {e}")
+        try:
+            db.rollback()
+        except mysql.connector.Error:
+            pass  # connection is gone; the next ping reconnects
+        return
     print(f"[ATTENDANCE] Marked {student_info[student_id]['name']} ({student_info[student_id]['usn']}) as {status}")
 
+# =========================
+# RECOGNITION HELPERS
+# =========================
+def attendance_status(stu):
+    """Status for the current time; notifies the parent for late/half-day entries"""
+    now_time = datetime.now().time()
+
+    if now_time <= time(8, 50):
+        return "present"
+    elif time(8, 50) < now_time < time(9, 15):
+        send_whatsapp(f"Late Entry: {stu['name']} ({stu['usn']}) reached late.", stu['parent_number'])
+        return "late"
+    elif time(12, 30) <= now_time <= time(13, 30):
+        send_whatsapp(f"Half Day: {stu['name']} ({stu['usn']}) attended half day.", stu['parent_number'])
+        return "half_day"
+    return "present"
+
+def remote_available():
+    return bool(REMOTE_WORKER_URL) and t.time() >= remote_down_until
+
+def post_to_worker(faces):
+    """POST faces to the worker; returns its per-face results or None on failure"""
+    global remote_down_until
+
+    try:
+        resp = remote_session.post(f"{REMOTE_WORKER_URL}/recognize",
+                                   json={"camera": CAMERA_NAME, "faces": faces}, timeout=REMOTE_TIMEOUT)
+        resp.raise_for_status()
+        return resp.json()["results"]
+    except Exception as e:
+        print(f"[WARN] Recognition worker unreachable, using on-device recognition: {e}")
+        remote_down_until = t.time() + REMOTE_RETRY_AFTER
+        return None
+
+def parse_worker_match(face):
+    student_id = face["student_id"]
+    # Worker gallery may be newer than ours; unknown ids count as no match
+    if student_id not in student_info:
+        student_id = None
+    candidates = [tuple(c) for c in face.get("candidates", [])]
+    return (student_id, face["distance"], candidates)
+
+def remote_detect(frame):
+    """Let the worker detect and recognize on the frame (full size unless REMOTE_FRAME_SCALE < 1).
+
+    Returns (boxes, matches) in full-frame coordinates, or None on failure.
+    """
+    small = frame
+    if REMOTE_FRAME_SCALE != 1.0:
+        small = cv2.resize(frame, (0, 0), fx=REMOTE_FRAME_SCALE, fy=REMOTE_FRAME_SCALE)
+    ok, jpeg = cv2.imencode(".jpg", small, [cv2.IMWRITE_JPEG_QUALITY, CROP_JPEG_QUALITY])
+    if not ok:
+        return None
+    results = post_to_worker([{"jpeg": base64.b64encode(jpeg.tobytes()).decode()}])
+    if results is None:
+        return None
+
+    detections = results[0] if results else []
+    boxes = [tuple(int(v / REMOTE_FRAME_SCALE) for v in d["box"]) for d in detections]
+    return boxes, [parse_worker_match(d) for d in detections]
+
+def remote_recognize(frame, boxes):
+    """Send JPEG face crops to the recognition worker.
+
+    Returns a (student_id or None, distance, candidates) tuple per box, or None if the
+    worker could not be reached so the caller can fall back to on-device.
+    """
+    if not remote_available():
+        return None
+
+    h, w = frame.shape[:2]
+    faces = []
+    for top, right, bottom, left in boxes:
+        mx = int((right - left) * CROP_MARGIN)
+        my = int((bottom - top) * CROP_MARGIN)
+        x0, y0 = max(left - mx, 0), max(top - my, 0)
+        x1, y1 = min(right + mx, w), min(bottom + my, h)
+        ok, jpeg = cv2.imencode(".jpg", frame[y0:y1, x0:x1], [cv2.IMWRITE_JPEG_QUALITY, CROP_JPEG_QUALITY])
+        if not ok:
+            return None
+        faces.append({
+            "jpeg": base64.b64encode(jpeg.tobytes()).decode(),
+            "box": [top - y0, right - x0, bottom - y0, left - x0],
+        })
+
+    results = post_to_worker(faces)
+    if results is None:
+        return None
+    return [parse_worker_match(face[0]) if face else (None, None, []) for face in results]
+
+def recognize(frame, rgb, boxes):
+    """Identify each box, remotely when a worker is configured, else on-device"""
+    matches = remote_recognize(frame, boxes)
+    if matches is None:
+        matches = match_encodings(known_matrix, known_ids, face_recognition.face_encodings(rgb, boxes))
+    return matches
+
+def draw_student(frame, box, stu):
+    top, right, bottom, left = box
+    cv2.rectangle(frame, (left, top), (right, bottom), (0, 255, 0), 2)
+    cv2.putText(frame, f"{stu['name']} | {stu['usn']}", (left, top - 10),
+                cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
+
+def report_unknown(frame):
+    global last_unknown
+    if not last_unknown:
+        print("[SECURITY] 🚨 Unknown person detected")
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        path = f"{UNAUTH_DIR}/UNAUTH_{timestamp}.jpg"
+        cv2.imwrite(path, frame)
+        with open("/home/pi/EduFace/alert_flag.txt", "w") as f:
+            f.write("ALERT")
+    last_unknown = True
+
+def update_mode(face_count):
+    """Enter/leave multi-face mode based on how long the face count stays high"""
+    global multi_face_mode, crowded_frames, quiet_frames
+
+    if face_count >= MULTI_FACE_MIN_FACES:
+        crowded_frames += 1
+        quiet_frames = 0
+    else:
+        quiet_frames += 1
+        crowded_frames = 0
+
+    if not multi_face_mode and crowded_frames >= MULTI_FACE_ENTER_FRAMES:
+        multi_face_mode = True
+        recognition_stable_count.clear()
+        print("[INFO] Multi-face mode ON")
+    elif multi_face_mode and quiet_frames >= MULTI_FACE_EXIT_FRAMES:
+        multi_face_mode = False
+        recognition_stable_count.clear()
+        print("[INFO] Multi-face mode OFF")
+
+def box_iou(a, b):
+    top, right = max(a[0], b[0]), min(a[1], b[1])
+    bottom, left = min(a[2], b[2]), max(a[3], b[3])
+    inter = max(0, bottom - top) * max(0, right - left)
+    union = (a[2] - a[0]) * (a[1] - a[3]) + (b[2] - b[0]) * (b[1] - b[3]) - inter
+    return inter / union if union > 0 else 0.0
+
+def assign_tracks(boxes):
+    """Greedily continue live tracks by box overlap; returns a track id per box"""
+    pairs = sorted(((box_iou(tr["box"], box), tid, i)
+                    for tid, tr in tracks.items() for i, box in enumerate(boxes)), reverse=True)
+    ids = [None] * len(boxes)
+    for score, tid, i in pairs:
+        if score < TRACK_MIN_IOU:
+            break
+        if ids[i] is None and tid not in ids:
+            ids[i] = tid
+
+    for tid in list(tracks):
+        if tid not in ids:
+            tracks[tid]["misses"] += 1
+            if tracks[tid]["misses"] > TRACK_MAX_MISSES:
+                del tracks[tid]
+                known_logged_tracks.discard(tid)
+    for i, box in enumerate(boxes):
+        if ids[i] is None:
+            ids[i] = next(track_counter)
+        tracks[ids[i]] = {"box": box, "misses": 0}
+    return ids
+
+def log_sighting(frame_ts, track, student_id, candidates):
+    """Log a recognized face; already-marked students are logged once per track, not every frame"""
+    if student_id not in marked_today:
+        log_event(frame_ts, track, student_id, candidates, "match")
+    elif track not in known_logged_tracks:
+        known_logged_tracks.add(track)
+        log_event(frame_ts, track, student_id, candidates, "known")
+
+def process_single(frame, rgb, boxes, track_ids, frame_ts, matches=None):
+    global last_unknown
+
+    # Pick largest face (closest to camera) and encode only that one
+    areas = [(b[2] - b[0]) * (b[1] - b[3]) for b in boxes]
+    idx = areas.index(max(areas))
+    box = boxes[idx]
+    track = track_ids[idx]
+    if matches is not None:
+        student_id, _, candidates = matches[idx]
+    else:
+        student_id, _, candidates = recognize(frame, rgb, [box])[0]
+
+    if student_id is not None:
+        stu = student_info[student_id]
+        draw_student(frame, box, stu)
+
+        recognition_stable_count[student_id] = recognition_stable_count.get(student_id, 0) + 1
+
+        if recognition_stable_count[student_id] >= STABLE_FRAMES and student_id not in marked_today:
+            status = attendance_status(stu)
+            log_event(frame_ts, track, student_id, candidates, "marked", status)
+
+            open_door()  # non-blocking call
+            mark_attendance(student_id, status)
+
+            marked_today.add(student_id)
+            recognition_stable_count.clear()
+            last_unknown = False
+        else:
+            log_sighting(frame_ts, track, student_id, candidates)
+
+    else:
+        log_event(frame_ts, track, None, candidates, "unknown")
+        recognition_stable_count.clear()
+        report_unknown(frame)
+
+def process_multi(frame, rgb, boxes, track_ids, frame_ts, matches=None):
+    """Recognize every face in the frame, with an independent stability counter per student"""
+    global last_unknown
+
+    if matches is None:
+        matches = recognize(frame, rgb, boxes)
+    seen = set()
+    unknown_seen = False
+    for box, (student_id, _, _) in zip(boxes, matches):
+        if student_id is None:
+            unknown_seen = True
+            continue
+        draw_student(frame, box, student_info[student_id])
+        seen.add(student_id)
+
+    # Counters only survive for students still in view
+    for student_id in list(recognition_stable_count):
+        if student_id not in seen:
+            del recognition_stable_count[student_id]
+
+    statuses = {}
+    for student_id in seen:
+        recognition_stable_count[student_id] = recognition_stable_count.get(student_id, 0) + 1
+        if recognition_stable_count[student_id] >= STABLE_FRAMES and student_id not in marked_today:
+            statuses[student_id] = attendance_status(student_info[student_id])
+
+    for track, (student_id, _, candidates) in zip(track_ids, matches):
+        if student_id is None:
+            log_event(frame_ts, track, None, candidates, "unknown")
+        elif student_id in statuses:
+            log_event(frame_ts, track, student_id, candidates, "marked", statuses[student_id])
+        else:
+            log_sighting(frame_ts, track, student_id, candidates)
+
+    if statuses:
+        open_door()  # one opening for the whole group
+        for student_id, status in statuses.items():
+            mark_attendance(student_id, status)
+            marked_today.add(student_id)
+            del recognition_stable_count[student_id]
+        last_unknown = False
+
+    if unknown_seen:
+        report_unknown(frame)
+
 # =========================
 # MAIN LOOP
 # =========================
@@ -114,62 +489,24 @@ while True:
     ret, frame = cap.read()
     if not ret:
         continue
+    frame_ts = t.time()
 
     rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-    boxes = face_recognition.face_locations(rgb)
-    encs = face_recognition.face_encodings(rgb, boxes)
+    remote = None
+    if not REMOTE_PREDETECT and remote_available():
+        remote = remote_detect(frame)
+    if remote is not None:
+        boxes, matches = remote
+    else:
+        boxes, matches = face_recognition.face_locations(rgb), None
+    update_mode(len(boxes))
+    track_ids = assign_tracks(boxes)
 
     if len(boxes) > 0:
-        # Pick largest face (closest to camera)
-        areas = [(b[2] - b[0]) * (b[1] - b[3]) for b in boxes]
-        idx = areas.index(max(areas))
-        top, right, bottom, left = boxes[idx]
-        enc = encs[idx]
-
-        distances = face_recognition.face_distance(known_encodings, enc)
-        min_index = np.argmin(distances)
-
-        if distances[min_index] < 0.58:
-            student_id = known_ids[min_index]
-            stu = student_info[student_id]
-
-            cv2.rectangle(frame, (left, top), (right, bottom), (0, 255, 0), 2)
-            cv2.putText(frame, f"{stu['name']} | {stu['usn']}", (left, top - 10),
-                        cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
-
-            recognition_stable_count[student_id] = recognition_stable_count.get(student_id, 0) + 1
-
-            if recognition_stable_count[student_id] >= 5 and student_id not in marked_today:
-                now_time = datetime.now().time()
-
-                if now_time <= time(8, 50):
-                    status = "present"
-                elif time(8, 50) < now_time < time(9, 15):
-                    status = "late"
-                    send_whatsapp(f"Late Entry: {stu['name']} ({stu['usn']}) reached late.", stu['parent_number'])
-                elif time(12, 30) <= now_time <= time(13, 30):
-                    status = "half_day"
-                    send_whatsapp(f"Half Day: {stu['name']} ({stu['usn']}) attended half day.", stu['parent_number'])
-                else:
-                    status = "present"
-
-                open_door()  # non-blocking call
-                mark_attendance(student_id, status)
-
-                marked_today.add(student_id)
-                recognition_stable_count.clear()
-                last_unknown = False
-
+        if multi_face_mode:
+            process_multi(frame, rgb, boxes, track_ids, frame_ts, matches)
         else:
-            recognition_stable_count.clear()
-            if not last_unknown:
-                print("[SECURITY] 🚨 Unknown person detected")
-                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                path = f"{UNAUTH_DIR}/UNAUTH_{timestamp}.jpg"
-                cv2.imwrite(path, frame)
-                with open("/home/pi/EduFace/alert_flag.txt", "w") as f:
-                    f.write("ALERT")
-            last_unknown = True
+            process_single(frame, rgb, boxes, track_ids, frame_ts, matches)
 
     else:
         recognition_stable_count.clear()
@@ -0,0 +1,38 @@
+import numpy as np
+
+# Shared by encode_faces.py and recognition_worker.py so on-device and
+# remote recognition decide matches the same way.
+MATCH_THRESHOLD = 0.58
+CANDIDATES = 3
+
+def distance_matrix(known_matrix, encs):
+    """(faces, known) euclidean distances in a single numpy call"""
+    return np.linalg.norm(known_matrix[np.newaxis, :, :] - np.asarray(encs)[:, np.newaxis, :], axis=2)
+
+def top_candidates(row, known_ids, limit=CANDIDATES):
+    """Closest `limit` distinct students for one row of distances, as (id, distance) pairs"""
+    candidates = []
+    for k in np.argsort(row):
+        if all(c[0] != known_ids[k] for c in candidates):
+            candidates.append((known_ids[k], float(row[k])))
+            if len(candidates) == limit:
+                break
+    return candidates
+
+def match_encodings(known_matrix, known_ids, encs, threshold=MATCH_THRESHOLD):
+    """Match a batch of face encodings against the gallery.
+
+    Returns a (student_id or None, distance, candidates) tuple per encoding.
+    """
+    if len(encs) == 0 or len(known_matrix) == 0:
+        return [(None, None, []) for _ in encs]
+
+    distances = distance_matrix(known_matrix, encs)
+    best = np.argmin(distances, axis=1)
+
+    matches = []
+    for i, min_index in enumerate(best):
+        dist = float(distances[i, min_index])
+        student_id = known_ids[min_index] if dist < threshold else None
+        matches.append((student_id, dist, top_candidates(distances[i], known_ids)))
+    return matches
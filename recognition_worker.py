@@ -0,0 +1,197 @@
+import base64
+import json
+import os
+import pickle
+import queue
+import threading
+import time as t
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import cv2
+import face_recognition
+import numpy as np
+
+import face_matching
+
+# =========================
+# WORKER CONFIG
+# =========================
+# Runs on any Linux box on the same LAN as the Pi edge nodes. For a local test:
+#   python recognition_worker.py
+#   REMOTE_WORKER_URL=http://127.0.0.1:8765 python encode_faces.py
+#   REMOTE_PREDETECT=0 ... also moves face detection off the Pi
+HOST = os.environ.get('WORKER_HOST', '0.0.0.0')
+PORT = int(os.environ.get('WORKER_PORT', '8765'))
+ENCODINGS_PATH = os.environ.get('ENCODINGS_PATH', '/home/pi/EduFace/encodings.pkl')
+MATCH_THRESHOLD = float(os.environ.get('MATCH_THRESHOLD', face_matching.MATCH_THRESHOLD))
+
+# Requests arriving within BATCH_WINDOW seconds of each other are matched together
+BATCH_WINDOW = 0.02
+BATCH_MAX_REQUESTS = 16
+REQUEST_TIMEOUT = 5.0
+# Jobs older than this are dropped unprocessed; the Pi has given up on them by now
+MAX_JOB_AGE = float(os.environ.get('MAX_JOB_AGE', '1.0'))
+# dlib encoding runs in separate processes so it can use every core
+ENCODE_WORKERS = int(os.environ.get('ENCODE_WORKERS', os.cpu_count() or 1))
+
+# =========================
+# LOAD ENCODINGS
+# =========================
+print("[INFO] Loading face encodings...")
+with open(ENCODINGS_PATH, "rb") as f:
+    known_encodings, known_ids = pickle.load(f)
+known_matrix = np.asarray(known_encodings)
+print(f"[INFO] Loaded {len(known_encodings)} encodings")
+
+jobs = queue.Queue()
+pool = None
+
+# =========================
+# RECOGNITION
+# =========================
+def decode_face(face):
+    """Decode one JPEG crop from a request; returns (rgb, boxes)"""
+    data = np.frombuffer(base64.b64decode(face['jpeg']), dtype=np.uint8)
+    img = cv2.imdecode(data, cv2.IMREAD_COLOR)
+    if img is None:
+        return None, []
+    rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+
+    if face.get('box'):
+        return rgb, [tuple(face['box'])]
+    # Edge node did not pre-detect, so find faces here
+    return rgb, face_recognition.face_locations(rgb)
+
+def encode_face(face):
+    """Pool task: decode and encode one face crop; returns [(box, encoding)]"""
+    rgb, boxes = decode_face(face)
+    if rgb is None or not boxes:
+        return []
+    return list(zip(boxes, face_recognition.face_encodings(rgb, boxes)))
+
+def recognize_batch(batch):
+    """Encode every face of every queued request in the pool, then match them all in one go"""
+    results = [[[] for _ in job['faces']] for job in batch]
+    tasks = []
+    for j, job in enumerate(batch):
+        for i, face in enumerate(job['faces']):
+            tasks.append((j, i, pool.submit(encode_face, face)))
+
+    encs = []
+    owners = []  # (job index, face index, box) per encoding
+    for j, i, future in tasks:
+        try:
+            for box, enc in future.result():
+                encs.append(enc)
+                owners.append((j, i, box))
+        except Exception as e:
+            print(f"[ERROR] decoding face from {batch[j]['camera']}: {e}")
+
+    matches = face_matching.match_encodings(known_matrix, known_ids, encs, MATCH_THRESHOLD)
+    for (j, i, box), (student_id, dist, candidates) in zip(owners, matches):
+        results[j][i].append({"box": [int(v) for v in box], "student_id": student_id,
+                              "distance": dist, "candidates": candidates})
+
+    # Publish only complete results; a handler may be checking concurrently
+    for job, job_results in zip(batch, results):
+        job['results'] = job_results
+
+def batch_loop():
+    while True:
+        batch = [jobs.get()]
+        deadline = t.monotonic() + BATCH_WINDOW
+        while len(batch) < BATCH_MAX_REQUESTS:
+            remaining = deadline - t.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(jobs.get(timeout=remaining))
+            except queue.Empty:
+                break
+
+        # Skip jobs whose request has already timed out on the Pi or here
+        now = t.monotonic()
+        fresh = []
+        for job in batch:
+            if job['abandoned'] or now - job['enqueued'] > MAX_JOB_AGE:
+                job['done'].set()
+            else:
+                fresh.append(job)
+        batch = fresh
+        if not batch:
+            continue
+
+        try:
+            recognize_batch(batch)
+        except Exception as e:
+            print(f"[ERROR] batch of {len(batch)} requests failed: {e}")
+            for job in batch:
+                job['results'] = None
+        for job in batch:
+            job['done'].set()
+
+# =========================
+# HTTP SERVER
+# =========================
+class WorkerHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != '/health':
+            self.send_error(404)
+            return
+        self.send_json(200, {"status": "ok", "encodings": len(known_encodings)})
+
+    def do_POST(self):
+        if self.path != '/recognize':
+            self.send_error(404)
+            return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            payload = json.loads(self.rfile.read(length))
+            faces = payload['faces']
+        except Exception as e:
+            self.send_json(400, {"error": f"bad request: {e}"})
+            return
+
+        job = {"camera": payload.get('camera', self.client_address[0]), "faces": faces,
+               "results": None, "done": threading.Event(),
+               "enqueued": t.monotonic(), "abandoned": False}
+        jobs.put(job)
+        if not job['done'].wait(REQUEST_TIMEOUT):
+            job['abandoned'] = True
+        if job['results'] is None:
+            self.send_json(503, {"error": "recognition failed"})
+            return
+
+        self.send_json(200, {"results": job['results']})
+
+    def send_json(self, code, body):
+        data = json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+# =========================
+# MAIN
+# =========================
+if __name__ == '__main__':
+    # ProcessPoolExecutor only forks its workers on the first submit(), so run
+    # one trivial task per worker now, while this is still the only thread,
+    # rather than letting the first batch fork them from a threaded process
+    pool = ProcessPoolExecutor(max_workers=ENCODE_WORKERS)
+    list(pool.map(int, range(ENCODE_WORKERS)))
+    threading.Thread(target=batch_loop, daemon=True).start()
+    server = ThreadingHTTPServer((HOST, PORT), WorkerHandler)
+    print(f"[INFO] ✅ Recognition worker listening on {HOST}:{PORT}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+    pool.shutdown()
+    print("[INFO] Worker stopped ✅")
@@ -0,0 +1,177 @@
+import argparse
+import glob
+import json
+import os
+from collections import Counter
+from datetime import datetime
+
+from face_matching import MATCH_THRESHOLD
+
+# Usage:
+#   python replay_events.py stats
+#   python replay_events.py backfill --date 2025-11-14
+EVENT_LOG_PATH = os.environ.get('EVENT_LOG_PATH', '/home/pi/EduFace/logs/recognition_events.log')
+NEAR_MISS_MARGIN = 0.05     # unknowns this close to the threshold count as near misses
+DIST_BUCKET = 0.02
+LATENCY_BUCKET_MS = 10
+
+# =========================
+# STREAMING READER
+# =========================
+def log_files(path):
+    """Rotated files oldest first: events.log.5, ..., events.log.1, events.log"""
+    rotated = [p for p in glob.glob(f"{path}.*") if p.rsplit('.', 1)[1].isdigit()]
+    rotated.sort(key=lambda p: int(p.rsplit('.', 1)[1]), reverse=True)
+    if os.path.exists(path):
+        rotated.append(path)
+    return rotated
+
+def read_events(path, day=None):
+    """Yield events one line at a time, optionally only those from one date"""
+    for file_path in log_files(path):
+        with open(file_path, 'r') as f:
+            for line in f:
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    continue  # torn line from a crash mid-write
+                if day and datetime.fromtimestamp(event['ts']).date() != day:
+                    continue
+                yield event
+
+# =========================
+# STATS
+# =========================
+def percentile(hist, bucket, total, q):
+    """Approximate percentile from a bucketed histogram"""
+    if total == 0:
+        return None
+    target = q * total
+    seen = 0
+    for k in sorted(hist):
+        seen += hist[k]
+        if seen >= target:
+            return (k + 1) * bucket
+    return None
+
+def stats(events):
+    decisions = Counter()
+    cameras = Counter()
+    dist_hist = Counter()
+    lat_hist = Counter()
+    per_minute = Counter()
+    near_misses = 0
+    ambiguous = 0
+    first_ts = last_ts = None
+
+    for e in events:
+        decisions[e['dec']] += 1
+        cameras[e['cam']] += 1
+        lat_hist[int(e['lat'] // LATENCY_BUCKET_MS)] += 1
+        first_ts = e['ts'] if first_ts is None else first_ts
+        last_ts = e['ts']
+
+        if e['dist']:
+            best = e['dist'][0]
+            dist_hist[int(best // DIST_BUCKET)] += 1
+            if e['dec'] == 'unknown' and best < MATCH_THRESHOLD + NEAR_MISS_MARGIN:
+                near_misses += 1
+            # Second-best student almost as close as the best one
+            if e['dec'] != 'unknown' and len(e['dist']) > 1 and e['dist'][1] - best < NEAR_MISS_MARGIN:
+                ambiguous += 1
+        if e['dec'] == 'marked':
+            per_minute[int(e['ts'] // 60)] += 1
+
+    total = sum(decisions.values())
+    if total == 0:
+        print("No events found")
+        return
+
+    span = datetime.fromtimestamp(first_ts), datetime.fromtimestamp(last_ts)
+    print(f"Events: {total} from {span[0]:%Y-%m-%d %H:%M:%S} to {span[1]:%Y-%m-%d %H:%M:%S}")
+    print("Cameras:", dict(cameras))
+    print("Decisions:", dict(decisions))
+
+    recognized = total - decisions['unknown']
+    print(f"Recognized faces: {recognized}/{total} ({100.0 * recognized / total:.1f}%)")
+    print(f"Near-miss unknowns (< {MATCH_THRESHOLD + NEAR_MISS_MARGIN:.2f}): {near_misses}")
+    print(f"Ambiguous matches (2nd candidate within {NEAR_MISS_MARGIN}): {ambiguous}")
+
+    lat_total = sum(lat_hist.values())
+    print("Latency ms p50/p90/p99: " + "/".join(
+        f"{percentile(lat_hist, LATENCY_BUCKET_MS, lat_total, q):.0f}" for q in (0.5, 0.9, 0.99)))
+
+    dist_total = sum(dist_hist.values())
+    if dist_total:
+        print("Best distance p10/p50/p90: " + "/".join(
+            f"{percentile(dist_hist, DIST_BUCKET, dist_total, q):.2f}" for q in (0.1, 0.5, 0.9)))
+        print("Best distance histogram:")
+        for k in sorted(dist_hist):
+            print(f"  {k * DIST_BUCKET:.2f}-{(k + 1) * DIST_BUCKET:.2f}: {dist_hist[k]}")
+
+    if per_minute:
+        peak_minute, peak = per_minute.most_common(1)[0]
+        print(f"Marked: {decisions['marked']} students, peak {peak}/min at "
+              f"{datetime.fromtimestamp(peak_minute * 60):%H:%M}")
+
+# =========================
+# BACKFILL
+# =========================
+def backfill(events, dry_run=False):
+    """Insert attendance rows for "marked" events that never reached MySQL"""
+    import mysql.connector
+
+    db = mysql.connector.connect(
+        host=os.environ.get('DB_HOST', 'localhost'),
+        user=os.environ.get('DB_USER', 'root'),
+        password=os.environ.get('DB_PASS', 'bhoomika2003'),
+        database=os.environ.get('DB_NAME', 'eduface')
+    )
+    cursor = db.cursor()
+
+    inserted = 0
+    done = set()
+    for e in events:
+        student_id = e.get('sid')
+        if e['dec'] != 'marked' or student_id is None:
+            continue
+        when = datetime.fromtimestamp(e['ts'])
+        if (student_id, when.date()) in done:
+            continue
+        done.add((student_id, when.date()))
+
+        cursor.execute("SELECT id FROM attendance WHERE student_id=%s AND date=%s", (student_id, when.date()))
+        if cursor.fetchone():
+            continue
+
+        print(f"[BACKFILL] {student_id} on {when.date()} at {when.time():%H:%M:%S} as {e.get('status', 'present')}")
+        if not dry_run:
+            cursor.execute(
+                "INSERT INTO attendance (student_id, date, time, status) VALUES (%s, %s, %s, %s)",
+                (student_id, when.date(), when.time(), e.get('status', 'present'))
+            )
+            db.commit()
+        inserted += 1
+
+    cursor.close()
+    db.close()
+    print(f"✅ Backfilled {inserted} attendance rows{' (dry run)' if dry_run else ''}")
+
+# =========================
+# MAIN
+# =========================
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Replay the EduFace recognition event log")
+    parser.add_argument('command', choices=['stats', 'backfill'])
+    parser.add_argument('--log', default=EVENT_LOG_PATH, help="event log path")
+    parser.add_argument('--date', help="only replay events from this date (YYYY-MM-DD)")
+    parser.add_argument('--dry-run', action='store_true', help="backfill: show rows without inserting")
+    args = parser.parse_args()
+
+    day = datetime.strptime(args.date, "%Y-%m-%d").date() if args.date else None
+    events = read_events(args.log, day)
+
+    if args.command == 'stats':
+        stats(events)
+    else:
+        backfill(events, args.dry_run)